@@ -0,0 +1,17 @@
+"""
+Category codes svg2geo writes into the category column, see
+svg2geo.describe, and the geo_* scripts filter on.  Plain constants,
+so that the geo_* scripts need not import svg2geo.
+"""
+NONE = 0
+LOCATION = 1
+LAKE = 2
+ROAD = 3
+TRAIL = 4
+UNPAVED = 5
+PAVED = 6
+# Codes by the names describe uses
+CATEGORIES = {'-': NONE, 'location': LOCATION, 'lake': LAKE, 'road': ROAD, 'trail': TRAIL,
+              'unpaved': UNPAVED, 'paved': PAVED}
+# All kinds of roads
+ROADS = [ROAD, TRAIL, UNPAVED, PAVED]
@@ -6,7 +6,7 @@ coast lines that are not closed.
 import sys
 import inspect
 import argparse
-import psycopg2
+import geo_db
 
 # This EPS value is used to grow the coast, thereby overgrowing rivers
 # up to twice this width.  The coast is then shrunk by twice this
@@ -22,35 +22,39 @@ import psycopg2
 
 EPS = 0.006 # roughly 0.006 x 100km = 600m
 
-def shortest_connect(table, cursor, line_id):
+def shortest_connect(table, cursor, line_id, deleted):
     """
     Returns the id of the closest line, the type, the geometry of it,
-    of the original line, and of the connecting line.
+    of the original line, and of the connecting line.  Lines in deleted
+    are skipped.
     """
     cursor.execute(f"""
-        SELECT wkb_geometry FROM {table} WHERE id = {line_id}""")
+        SELECT wkb_geometry FROM {table} WHERE id = %s""", [line_id], prepare=True)
     line_geo = cursor.fetchall()[0][0]
-    p_11 = f"(1, ST_StartPoint('{line_geo}'::geometry))"
-    p_12 = f"(2, ST_EndPoint('{line_geo}'::geometry))"
+    p_11 = "(1, ST_StartPoint(%(line)s))"
+    p_12 = "(2, ST_EndPoint(%(line)s))"
     p_21 = f"(1, ST_StartPoint(main.wkb_geometry))"
     p_22 = f"(2, ST_EndPoint(main.wkb_geometry))"
     cursor.execute(f"""
       SELECT add_id, add_type, add_geo, line_geo, connect_geo FROM (
-        SELECT main.id, main.type, main.wkb_geometry, '{line_geo}', (
+        SELECT main.id, main.type, main.wkb_geometry, %(line)s, (
           WITH pts1 (i, p) AS (VALUES {p_11}, {p_12}), 
             pts2 (i, p) AS (VALUES {p_21}, {p_22})
           SELECT ST_MakeLine(pt1.p, pt2.p) FROM pts1 AS pt1 CROSS JOIN pts2 AS pt2
-          WHERE (main.id <> {line_id} OR pt1.i <> pt2.i)
+          WHERE (main.id <> %(id)s OR pt1.i <> pt2.i)
           ORDER BY ST_Distance(pt1.p, pt2.p) ASC LIMIT 1
         )
         FROM {table} AS main
+        WHERE main.id <> ALL(%(deleted)s::integer[]) AND
+          -- implied by the length test below, but can use the index
+          ST_DWithin(main.wkb_geometry, %(line)s, {EPS})
       )
       AS connects (add_id, add_type, add_geo, line_geo, connect_geo)
       WHERE ST_Length(connects.connect_geo) < {EPS} AND (
-        connects.add_type LIKE '%COASTLINE%' OR connects.add_type = '0'
+        connects.add_type LIKE '%%COASTLINE%%' OR connects.add_type = '0'
       )
       ORDER BY ST_Length(connects.connect_geo) ASC LIMIT 1
-    """)
+    """, {'line': line_geo, 'id': line_id, 'deleted': deleted}, prepare=True)
     ret = cursor.fetchall()
     return ret
 
@@ -83,10 +87,10 @@ def make_valid_lake(args, cursor, geo, line_id):
     cursor.execute(f"""
       INSERT INTO {args.table}_lines (id, name, type, wkb_geometry)
       VALUES (
-        nextval('serial'), 'nameless', '/COASTLINE/tmp-lake', '{geo}'::geometry
+        nextval('serial'), 'nameless', '/COASTLINE/tmp-lake', %s
       )
       RETURNING id
-    """)
+    """, [geo])
     lake_id = cursor.fetchall()[0][0]
     verbosity(args.verbose, f"- lake {lake_id} from {line_id}")
     name_lake(args, cursor, lake_id)
@@ -95,14 +99,13 @@ def make_valid_line(table, cursor, merge, line_id):
     """Removes the smallest segments until a single line remains. Update."""
     multi_line = True
     while multi_line:
-        sql_array = "'" + "'::geometry, '".join(merge) + "'::geometry"
         cursor.execute(f"""
           SELECT geo FROM (
-            SELECT (ST_Dump(ST_LineMerge(ST_Union(ARRAY[{sql_array}])))).geom
+            SELECT (ST_Dump(ST_LineMerge(ST_Union(%s::geometry[])))).geom
           )
           AS lines (geo)
           ORDER BY ST_Length(geo) DESC
-        """)
+        """, [list(merge)], prepare=True)
         merge = cursor.fetchall()
         if len(merge) == 1:
             break
@@ -110,9 +113,9 @@ def make_valid_line(table, cursor, merge, line_id):
 
     cursor.execute(f"""
       UPDATE {table}
-      SET wkb_geometry = '{merge[0][0]}'::geometry
-      WHERE id = {line_id}
-    """)
+      SET wkb_geometry = %s
+      WHERE id = %s
+    """, [merge[0][0], line_id], prepare=True)
 
 def encircle(args, cursor, isle_id):
     """Make a valid polygon and extract rivers."""
@@ -130,20 +133,21 @@ def encircle(args, cursor, isle_id):
       WHERE isle.id = {isle_id} AND (river.type LIKE '%COASTLINE%' OR river.type = '0') AND
         ST_Intersects(ST_MakePolygon(isle.wkb_geometry), river.wkb_geometry)
     """)
-    for river in cursor.fetchall():
-        cursor.execute(f"""
-          INSERT INTO {args.table}_lines (id, name, type, style, wkb_geometry)
-          VALUES (
-            nextval('serial'), 'temporary area river',
-            '/STREAMS-LAKE/tmp-river', 'fill: #36868d',
-            ST_AddPoint('{river[1]}'::geometry, ST_StartPoint('{river[1]}'::geometry))
-          )
-          RETURNING id
-        """)
-        print(f"- new area river: {cursor.fetchall()[0][0]}")
-        cursor.execute(f"""
-          DELETE FROM {args.table}_lines WHERE id = {river[0]}
-        """)
+    rivers = geo_db.write_back(cursor, ['id integer', 'geo geometry'], cursor.fetchall(), f"""
+      INSERT INTO {args.table}_lines (id, name, type, style, wkb_geometry)
+      SELECT
+        nextval('serial'), 'temporary area river',
+        '/STREAMS-LAKE/tmp-river', 'fill: #36868d',
+        ST_AddPoint(geo, ST_StartPoint(geo))
+      FROM write_back
+      RETURNING id
+    """, f"""
+      DELETE FROM {args.table}_lines AS t0
+      USING write_back AS t1
+      WHERE t0.id = t1.id
+    """)
+    for river in rivers:
+        print(f"- new area river: {river[0]}")
 
 def execute(args, cursor):
     """Top-level work-horse function. Connecting, Islands, then Lakes."""
@@ -180,18 +184,20 @@ def execute(args, cursor):
         if line[0] in deleted:
             continue
         verbosity(args.verbose, f"- connect {line[0]}")
-        connect = shortest_connect(f"{args.table}_lines", cursor, line[0])
+        connect = shortest_connect(f"{args.table}_lines", cursor, line[0], deleted)
         while len(connect) > 0:
             verbosity(args.verbose, f"- - with {connect[0][0]}")
             make_valid_line(f"{args.table}_lines", cursor, connect[0][2:], line[0])
             if line[0] == connect[0][0]:
                 break
             verbosity(args.verbose, f"- - remove {connect[0][0]}")
-            cursor.execute(f"""
-              DELETE FROM {args.table}_lines WHERE id = {connect[0][0]}
-            """)
             deleted.append(connect[0][0])
-            connect = shortest_connect(f"{args.table}_lines", cursor, line[0])
+            connect = shortest_connect(f"{args.table}_lines", cursor, line[0], deleted)
+    geo_db.write_back(cursor, ['id integer'], [[line_id] for line_id in deleted], f"""
+      DELETE FROM {args.table}_lines AS t0
+      USING write_back AS t1
+      WHERE t0.id = t1.id
+    """)
 
     # Islands
     print(f"Special: Melderyn Isle")
@@ -312,13 +318,9 @@ def main():
         required=False)
     args = parser.parse_args()
 
-    conn = psycopg2.connect(
-        user=f"{args.db.split('@')[0].split(':')[0]}",
-        password=f"{args.db.split('@')[0].split(':')[1]}",
-        database=f"{args.db.split('@')[1].split(':')[0]}",
-        host=f"{args.db.split('@')[1].split(':')[1]}",
-        port=f"{args.db.split('@')[1].split(':')[2]}")
+    conn = geo_db.connect(args.db, 'coast')
     cursor = conn.cursor()
+    geo_db.ensure_indexes(cursor, f"{args.table}_lines")
 
     # Initialize
     cursor.execute(f"""
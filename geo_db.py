@@ -0,0 +1,179 @@
+"""
+Database access shared by the geo_* scripts.  Geometries are returned
+as shapely geometries, decoded in bulk per fetch, and are sent as
+binary EWKB parameters, e.g.
+
+    cursor.execute("SELECT ST_Length(%s)", [geometry])
+
+instead of being pasted into the statement as '...'::geometry.  Note
+that statements with parameters must write % as %%, e.g. LIKE '%%STREAMS%%'.
+
+Each stage opens one connection with the statement timeout of the
+stage.  Statements repeated per row should keep their text constant,
+with the varying values as parameters, and pass prepare=True so that
+they are parsed and planned once per stage.
+"""
+import psycopg
+import shapely
+from psycopg.adapt import Dumper, Loader
+from psycopg.pq import Format
+from psycopg.types import TypeInfo
+
+# Statement timeout per stage, well above the runtime of the whole
+# stage, so that only a runaway statement is cancelled
+TIMEOUTS = {
+    'pts': '20min',
+    'elevation': '1h',
+    'coast': '30min',
+    'lakes': '10min',
+    'roads': '10min',
+    'vegetation': '30min',
+    'rivers': '1h',
+    'height': '1h',
+    'export': '30min'}
+# Rows staged per COPY in write_back
+WRITE_BATCH = 10000
+
+def connect(db, stage):
+    """
+    Connect to user:password@dbname:host:port for stage.  A stage keeps
+    its connection for the whole run, as the temporary sequences live in
+    its session.
+    """
+    conn = psycopg.connect(
+        user=f"{db.split('@')[0].split(':')[0]}",
+        password=f"{db.split('@')[0].split(':')[1]}",
+        dbname=f"{db.split('@')[1].split(':')[0]}",
+        host=f"{db.split('@')[1].split(':')[1]}",
+        port=f"{db.split('@')[1].split(':')[2]}",
+        options=f"-c statement_timeout={TIMEOUTS[stage]}",
+        cursor_factory=Cursor)
+    conn.server_cursor_factory = ServerCursor
+    register_geometry(conn)
+    conn.commit()
+    return conn
+
+def write_back(cursor, columns, rows, *statements):
+    """
+    Stage rows with COPY into the temporary table write_back of
+    columns, e.g. ['id integer', 'name varchar'], and apply statements
+    like UPDATE ... FROM write_back or DELETE ... USING write_back once
+    per batch.  Returns what the statements return.
+    """
+    # Qualified, so that a permanent table of that name is never dropped
+    cursor.execute("DROP TABLE IF EXISTS pg_temp.write_back")
+    cursor.execute(f"CREATE TEMP TABLE write_back ({', '.join(columns)})")
+    ret = []
+    for start in range(0, len(rows), WRITE_BATCH):
+        cursor.execute("TRUNCATE write_back")
+        with cursor.copy("COPY write_back FROM STDIN") as copy:
+            for row in rows[start:start + WRITE_BATCH]:
+                copy.write_row(row)
+        for statement in statements:
+            cursor.execute(statement)
+            if cursor.description is not None:
+                ret += cursor.fetchall()
+    return ret
+
+def ensure_indexes(cursor, *tables):
+    """
+    Create the GIST index on wkb_geometry, as ogr2ogr and svg2geo name
+    it, for those tables that have none.
+    """
+    for table in tables:
+        cursor.execute("""
+          SELECT count(*) FROM pg_indexes
+          WHERE tablename = %s AND indexdef LIKE '%%USING gist (wkb_geometry)%%'
+        """, [table])
+        if cursor.fetchall()[0][0] == 0:
+            print(f"Create index on {table}")
+            cursor.execute(f"""
+              CREATE INDEX {table}_wkb_geometry_geom_idx ON {table} USING GIST (wkb_geometry)
+            """)
+            cursor.execute(f"ANALYZE {table}")
+
+def within(geo_a, geo_b, eps):
+    """
+    SQL for ST_Distance(geo_a, geo_b) < eps.  ST_DWithin, which includes
+    eps, lets PostGIS use the GIST index of a geometry column argument.
+    """
+    return f"(ST_DWithin({geo_a}, {geo_b}, {eps}) AND ST_Distance({geo_a}, {geo_b}) < {eps})"
+
+def by_distance(geo_a, geo_b):
+    """
+    SQL to ORDER BY instead of ST_Distance(geo_a, geo_b) ASC.  With
+    LIMIT and a geometry column argument it is a KNN search on its GIST
+    index.
+    """
+    return f"{geo_a} <-> {geo_b}"
+
+class GeometryLoader(Loader):
+    """Keep the hex EWKB text; it is decoded in bulk by the cursor."""
+    def load(self, data):
+        return bytes(data).decode('ascii')
+
+class GeometryBinaryLoader(Loader):
+    """Keep the EWKB bytes; they are decoded in bulk by the cursor."""
+    format = Format.BINARY
+
+    def load(self, data):
+        return bytes(data)
+
+class GeometryDumper(Dumper):
+    """Send shapely geometries as hex EWKB, keeping their SRID; used in arrays."""
+    def dump(self, obj):
+        return shapely.to_wkb(obj, hex=True, include_srid=True).encode('ascii')
+
+class GeometryBinaryDumper(Dumper):
+    """Send shapely geometries as EWKB, keeping their SRID."""
+    format = Format.BINARY
+
+    def dump(self, obj):
+        return shapely.to_wkb(obj, include_srid=True)
+
+def register_geometry(conn):
+    """Register the geometry adapters; needs PostGIS in the database."""
+    info = TypeInfo.fetch(conn, 'geometry')
+    if info is None:
+        raise psycopg.ProgrammingError("geometry type not found, is PostGIS installed?")
+    # Also makes lists of geometries bind as geometry[]
+    info.register(conn)
+    conn.adapters.register_loader(info.oid, GeometryLoader)
+    conn.adapters.register_loader(info.oid, GeometryBinaryLoader)
+    # The binary dumper, registered last, is the default for %s
+    for dumper in [GeometryDumper, GeometryBinaryDumper]:
+        conn.adapters.register_dumper(
+            shapely.Geometry, type(dumper.__name__, (dumper,), {'oid': info.oid}))
+
+class DecodeMixin:
+    """Decode the geometry columns of each fetch with one shapely.from_wkb per column."""
+    def decode(self, rows):
+        """Replace EWKB by shapely geometries."""
+        info = self.adapters.types.get('geometry')
+        if not rows or self.description is None or info is None:
+            return rows
+        columns = [idx for idx, column in enumerate(self.description)
+                   if column.type_code == info.oid]
+        if not columns:
+            return rows
+        rows = [list(row) for row in rows]
+        for idx in columns:
+            for row, geometry in zip(rows, shapely.from_wkb([row[idx] for row in rows])):
+                row[idx] = geometry
+        return [tuple(row) for row in rows]
+
+    def fetchone(self):
+        row = super().fetchone()
+        return None if row is None else self.decode([row])[0]
+
+    def fetchmany(self, size=0):
+        return self.decode(super().fetchmany(size))
+
+    def fetchall(self):
+        return self.decode(super().fetchall())
+
+class Cursor(DecodeMixin, psycopg.Cursor):
+    """Client side cursor returning shapely geometries."""
+
+class ServerCursor(DecodeMixin, psycopg.ServerCursor):
+    """Named cursor returning shapely geometries."""
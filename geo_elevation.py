@@ -6,7 +6,7 @@ heuristics for connected lines and rings.
 """
 import sys
 import argparse
-import psycopg2
+import geo_db
 
 EPSP = 0.0025
 EPSL = 0.007
@@ -16,36 +16,40 @@ def verbosity(verb, out):
     if verb:
         print(f" - {out}")
 
-def shortest_connect(table, cursor, line_id, line_type):
+def shortest_connect(table, cursor, line_id, line_type, deleted):
     """
     Returns the id of the closest line, the type, the geometry of it,
-    of the original line, and of the connecting line.
+    of the original line, and of the connecting line.  Lines in deleted
+    are skipped.
     """
     cursor.execute(f"""
-      SELECT wkb_geometry FROM {table} WHERE id = {line_id}
-    """)
+      SELECT wkb_geometry FROM {table} WHERE id = %s
+    """, [line_id], prepare=True)
     line_geo = cursor.fetchall()[0][0]
-    p_11 = f"(1, ST_StartPoint('{line_geo}'::geometry))"
-    p_12 = f"(2, ST_EndPoint('{line_geo}'::geometry))"
+    p_11 = "(1, ST_StartPoint(%(line)s))"
+    p_12 = "(2, ST_EndPoint(%(line)s))"
     p_21 = f"(1, ST_StartPoint(main.wkb_geometry))"
     p_22 = f"(2, ST_EndPoint(main.wkb_geometry))"
     cursor.execute(f"""
       SELECT add_id, add_type, add_geo, line_geo, connect_geo FROM (
-        SELECT main.id, main.type, main.wkb_geometry, '{line_geo}', (
+        SELECT main.id, main.type, main.wkb_geometry, %(line)s, (
           WITH pts1 (i, p) AS (VALUES {p_11}, {p_12}), 
             pts2 (i, p) AS (VALUES {p_21}, {p_22})
           SELECT ST_MakeLine(pt1.p, pt2.p) FROM pts1 AS pt1 CROSS JOIN pts2 AS pt2
-          WHERE (main.id <> {line_id} OR pt1.i <> pt2.i)
+          WHERE (main.id <> %(id)s OR pt1.i <> pt2.i)
           ORDER BY ST_Distance(pt1.p, pt2.p) ASC LIMIT 1
         )
         FROM {table} AS main
+        WHERE main.id <> ALL(%(deleted)s::integer[]) AND
+          -- implied by the length test below, but can use the index
+          ST_DWithin(main.wkb_geometry, %(line)s, {EPSL})
       )
       AS connects (add_id, add_type, add_geo, line_geo, connect_geo)
       WHERE ST_Length(connects.connect_geo) < {EPSL} AND
-        (connects.add_type LIKE '%CONTOURS%' OR connects.add_type = '{line_type}'
+        (connects.add_type LIKE '%%CONTOURS%%' OR connects.add_type = %(type)s
         )
       ORDER BY ST_Length(connects.connect_geo) ASC LIMIT 1
-    """)
+    """, {'line': line_geo, 'id': line_id, 'type': line_type, 'deleted': deleted}, prepare=True)
     ret = cursor.fetchall()
     return ret
 
@@ -53,13 +57,12 @@ def make_valid(table, cursor, merge, line_id):
     """Removes the smallest segments until a single line remains. Update."""
     multi_line = True
     while multi_line:
-        sql_array = "'" + "'::geometry, '".join(merge) + "'::geometry"
         cursor.execute(f"""
           SELECT geo FROM (
-            SELECT (ST_Dump(ST_LineMerge(ST_Union(ARRAY[{sql_array}])))).geom
+            SELECT (ST_Dump(ST_LineMerge(ST_Union(%s::geometry[])))).geom
           )
           AS lines (geo) ORDER BY ST_Length(geo) DESC
-        """)
+        """, [list(merge)], prepare=True)
         merge = cursor.fetchall()
         if len(merge) == 1:
             break
@@ -67,9 +70,9 @@ def make_valid(table, cursor, merge, line_id):
 
     cursor.execute(f"""
       UPDATE {table}
-      SET wkb_geometry = '{merge[0][0]}'::geometry
-      WHERE id = {line_id}
-    """)
+      SET wkb_geometry = %s
+      WHERE id = %s
+    """, [merge[0][0], line_id], prepare=True)
 
 def sort_elevation_pts(table, cursor):
     """Sort all elevation points to their elevation."""
@@ -80,10 +83,7 @@ def sort_elevation_pts(table, cursor):
       GROUP BY elev
     """)
     points = cursor.fetchall()
-    elevsets = ""
-    for pt_i in points:
-        elevsets += f"({pt_i[0]}, '{pt_i[1]}'::geometry),"
-    return elevsets
+    return [[pt_i[0] for pt_i in points], [pt_i[1] for pt_i in points]]
 
 def handle_unlabeled_rings(args, cursor):
     """Handle unlabeld rings."""
@@ -116,12 +116,12 @@ def label_rings(verbose, table, cursor, line):
     verbosity(verbose, f"ring {line[0]}")
     cursor.execute(f"""
       SELECT id, type FROM {table}
-      WHERE (type LIKE '%CONTOURS%' OR type LIKE '%00%') AND
+      WHERE (type LIKE '%%CONTOURS%%' OR type LIKE '%%00%%') AND
         CASE WHEN ST_IsClosed(wkb_geometry) THEN
-          ST_Covers(ST_MakePolygon(wkb_geometry), '{line[1]}'::geometry)
+          ST_Covers(ST_MakePolygon(wkb_geometry), %(ring)s)
         END
-      ORDER BY ST_Distance(wkb_geometry, '{line[1]}'::geometry) ASC
-    """)
+      ORDER BY ST_Distance(wkb_geometry, %(ring)s) ASC
+    """, {'ring': line[1]}, prepare=True)
     rings = list(enumerate(cursor.fetchall()))
     for idx_r, ring in rings:
         if "00" not in ring[1]:
@@ -134,9 +134,9 @@ def label_rings(verbose, table, cursor, line):
                 print(f"- - - errorneous fix {check} with {elev}")
             cursor.execute(f"""
               UPDATE {table}
-              SET type = '{elev}'
-              WHERE id = {check[0]} AND type LIKE '%CONTOURS%'
-            """)
+              SET type = %s
+              WHERE id = %s AND type LIKE '%%CONTOURS%%'
+            """, [str(elev), check[0]], prepare=True)
 
 def main():
     """Main method."""
@@ -154,18 +154,16 @@ def main():
         help='verbose', required=False)
     args = parser.parse_args()
 
-    conn = psycopg2.connect(
-        user=f"{args.db.split('@')[0].split(':')[0]}",
-        password=f"{args.db.split('@')[0].split(':')[1]}",
-        database=f"{args.db.split('@')[1].split(':')[0]}",
-        host=f"{args.db.split('@')[1].split(':')[1]}",
-        port=f"{args.db.split('@')[1].split(':')[2]}")
+    conn = geo_db.connect(args.db, 'elevation')
     cursor = conn.cursor()
+    geo_db.ensure_indexes(cursor, f"{args.table}_lines", f"{args.table}_pts")
 
     # Initialize
     cursor.execute(f"""
       CREATE TEMP SEQUENCE IF NOT EXISTS serial START 400000;
-      ALTER TABLE {args.table}_lines ALTER id SET NOT NULL;
+      ALTER TABLE {args.table}_lines ALTER id SET NOT NULL
+    """)
+    cursor.execute(f"""
       SELECT count(*) FROM {args.table}_lines WHERE type LIKE '%CONTOURS%'
     """)
     print(f"Identifying lines: {cursor.fetchall()[0][0]}")
@@ -202,14 +200,14 @@ def main():
     cursor.execute(f"""
       UPDATE {args.table}_lines
       SET type = t3.b FROM (
-        WITH elev (idx, geom) AS (VALUES {elevsets[:-1]})
+        WITH elev (idx, geom) AS (SELECT * FROM unnest(%s::text[], %s::geometry[]))
         SELECT t1.id, t2.idx || '00' FROM {args.table}_lines AS t1 JOIN elev AS t2 ON TRUE
-        WHERE ST_Distance(t2.geom, t1.wkb_geometry) < {EPSP}
+        WHERE {geo_db.within("t2.geom", "t1.wkb_geometry", EPSP)}
         ORDER BY ST_Distance(t2.geom, t1.wkb_geometry)
       )
       AS t3 (a, b)
-      WHERE id = t3.a AND type LIKE '%CONTOURS%'
-    """)
+      WHERE id = t3.a AND type LIKE '%%CONTOURS%%'
+    """, elevsets)
 
     cursor.execute(f"""
       SELECT count(*) FROM {args.table}_lines WHERE type LIKE '%CONTOURS%'
@@ -228,18 +226,20 @@ def main():
         if line[0] in deleted:
             continue
         verbosity(args.verbose, f"connect {line[0]}")
-        connect = shortest_connect(f"{args.table}_lines", cursor, line[0], line[1])
+        connect = shortest_connect(f"{args.table}_lines", cursor, line[0], line[1], deleted)
         while len(connect) > 0:
             verbosity(args.verbose, f"- with {connect[0][0]}")
             make_valid(f"{args.table}_lines", cursor, connect[0][2:], line[0])
             if line[0] == connect[0][0]:
                 break
             verbosity(args.verbose, f"- remove {connect[0][0]}")
-            cursor.execute(f"""
-              DELETE FROM {args.table}_lines WHERE id = {connect[0][0]}
-            """)
             deleted.append(connect[0][0])
-            connect = shortest_connect(f"{args.table}_lines", cursor, line[0], line[1])
+            connect = shortest_connect(f"{args.table}_lines", cursor, line[0], line[1], deleted)
+    geo_db.write_back(cursor, ['id integer'], [[line_id] for line_id in deleted], f"""
+      DELETE FROM {args.table}_lines AS t0
+      USING write_back AS t1
+      WHERE t0.id = t1.id
+    """)
 
     # Closed non-labelled
     cursor.execute(f"""
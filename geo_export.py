@@ -0,0 +1,108 @@
+#!/usr/bin/python
+"""
+Exports the tables as GeoJSON reprojected onto the Kethira sphere, as
+served to index.html.  The tables are streamed in batches and written
+in parallel, one process per table.
+"""
+import sys
+import json
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+import numpy
+import shapely
+import geo_db
+from pyproj import CRS, Transformer
+
+SOURCE_WKT = 'kethira-sin30w.wkt'
+TARGET_WKT = 'kethira-sphere.wkt'
+# Rows fetched and reprojected at once
+BATCH = 10000
+# Table suffixes exported
+SUFFIXES = ['lines', 'polys', 'pts']
+# Not written as properties
+SKIP_COLUMNS = ['ogc_fid', 'wkb_geometry']
+
+def get_transformer():
+    """Get the transform from the atlas projection onto the sphere."""
+    with open(SOURCE_WKT, encoding='utf-8') as source:
+        with open(TARGET_WKT, encoding='utf-8') as target:
+            return Transformer.from_crs(CRS.from_wkt(source.read()),
+                                        CRS.from_wkt(target.read()), always_xy=True)
+
+def write_features(out, columns, rows, transformer, precision, first):
+    """
+    Reproject a batch of rows, the geometry last, and write them as
+    features.  Coordinates are rounded to precision decimals, if given.
+    """
+    def reproject(coords):
+        coords = numpy.column_stack(transformer.transform(coords[:, 0], coords[:, 1]))
+        return coords if precision is None else numpy.round(coords, precision)
+    geometries = shapely.transform([row[-1] for row in rows], reproject)
+    for row, geometry in zip(rows, shapely.to_geojson(geometries)):
+        if not first:
+            out.write(",\n")
+        first = False
+        out.write('{"type": "Feature", "properties": ' +
+                  json.dumps(dict(zip(columns, row[:-1])), default=str) +
+                  ', "geometry": ' + (geometry or 'null') + '}')
+
+def export_table(args, suffix):
+    """Stream a table through a server-side cursor into its file."""
+    with geo_db.connect(args.db, 'export') as conn:
+        cursor = conn.cursor()
+        cursor.execute(f"SELECT * FROM {args.table}_{suffix} LIMIT 0")
+        columns = [column.name for column in cursor.description
+                   if column.name not in SKIP_COLUMNS]
+        transformer = get_transformer()
+        # Named cursors stay on the server and only send what is fetched
+        cursor = conn.cursor(name=f"export_{suffix}")
+        cursor.execute(f"""
+          SELECT {"".join(f"{column}, " for column in columns)}wkb_geometry
+          FROM {args.table}_{suffix}
+        """)
+        count = 0
+        with open(f"{args.prefix}_{suffix}.json", 'w', encoding='utf-8') as out:
+            out.write('{"type": "FeatureCollection", ' +
+                      f'"name": "{args.table}_{suffix}", "features": [\n')
+            while True:
+                rows = cursor.fetchmany(BATCH)
+                if len(rows) == 0:
+                    break
+                write_features(out, columns, rows, transformer, args.precision, count == 0)
+                count += len(rows)
+                if args.verbose:
+                    print(f"- {suffix}: {count}")
+            out.write("\n]}\n")
+    return count
+
+def main():
+    """Main method."""
+    parser = argparse.ArgumentParser(
+        prog=sys.argv[0],
+        description='Export tables as GeoJSON on the Kethira sphere.')
+    parser.add_argument(
+        '-d', '--database', dest='db', required=True,
+        help='db to connect to user:password@dbname:host:port')
+    parser.add_argument(
+        '-t', '--table', dest='table', required=True,
+        help='table prefix; _pts, _lines and _polys will be added')
+    parser.add_argument(
+        '-o', '--output', dest='prefix', default='ah',
+        help='file prefix; _pts.json, _lines.json and _polys.json will be added ' +
+        '(default ah)', required=False)
+    parser.add_argument(
+        '-p', '--precision', dest='precision', type=int, default=None,
+        help='decimals of the coordinates written (default all)', required=False)
+    parser.add_argument(
+        '-v', '--verbose', action='store_true',
+        help='verbose', required=False)
+    args = parser.parse_args()
+
+    with ProcessPoolExecutor(max_workers=len(SUFFIXES)) as pool:
+        futures = [(suffix, pool.submit(export_table, args, suffix)) for suffix in SUFFIXES]
+        for suffix, future in futures:
+            count = future.result()
+            print(f"Exported {count} features to {args.prefix}_{suffix}.json")
+
+if __name__ == '__main__':
+    main()
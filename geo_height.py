@@ -4,7 +4,7 @@ Creates some default heights.
 """
 import sys
 import argparse
-import psycopg2
+import geo_db
 import rasterio
 import numpy
 
@@ -20,7 +20,7 @@ def get_partitions(args, cursor, pts):
     while True:
         # Base
         cursor.execute(f"""
-          SELECT id, ST_AsText(wkb_geometry) FROM {args.table}_polys
+          SELECT id, wkb_geometry FROM {args.table}_polys
           WHERE type = '{500*level}' AND
             ST_Intersects(wkb_geometry, ST_MakeEnvelope({pts[0]}, {pts[1]}, {pts[2]}, {pts[3]}))
         """)
@@ -29,24 +29,24 @@ def get_partitions(args, cursor, pts):
         for found in found_list:
             # Holes
             cursor.execute(f"""
-              SELECT id, ST_AsText(wkb_geometry) FROM {args.table}_polys
+              SELECT id, wkb_geometry FROM {args.table}_polys
               WHERE type = '{500*level + 500}' AND
-                ST_Covers('{found[1]}'::geometry, wkb_geometry)
-            """)
+                ST_Covers(%s, wkb_geometry)
+            """, [found[1]])
             holes = cursor.fetchall()
             # Peaks
             cursor.execute(f"""
               SELECT id FROM {args.table}_pts
               WHERE type = 'PEAK' AND
-                ST_Covers('{found[1]}'::geometry, wkb_geometry)
-            """)
+                ST_Covers(%s, wkb_geometry)
+            """, [found[1]])
             peaks = [p[0] for p in cursor.fetchall()]
             for hole in holes:
                 cursor.execute(f"""
                   SELECT id FROM {args.table}_pts
                   WHERE type = 'PEAK' AND
-                    ST_Covers('{hole[1]}'::geometry, wkb_geometry)
-                """)
+                    ST_Covers(%s, wkb_geometry)
+                """, [hole[1]])
                 peaks = list(set(peaks) - {d[0] for d in cursor.fetchall()})
             base_list.append({"base": found[0], "holes": [h[0] for h in holes], "peaks": peaks})
         if len(found_list) == 0:
@@ -79,38 +79,34 @@ def handle_partitions(args, cursor, partitions, pts):
     # Matching is top down, thereby we don't have to evaluate holes.
     for partition in reversed(partitions):
         for pline in partition:
+            params = {'x': float(pts[0]), 'y': float(pts[1]), 'base': pline['base'],
+                      'peaks': pline['peaks'], 'holes': pline['holes']}
             cursor.execute(f"""
-              SELECT ST_Covers(wkb_geometry, ST_GeomFromText('POINT({pts[0]} {pts[1]})'))
+              SELECT ST_Covers(wkb_geometry, ST_MakePoint(%(x)s, %(y)s))
               FROM {args.table}_polys
-              WHERE id = {pline['base']}
-            """)
+              WHERE id = %(base)s
+            """, params, prepare=True)
             result = cursor.fetchall()[0]
             if result[0]:
-                peak_c = f"id IN ({','.join([str(p) for p in pline['peaks']])})"
-                if peak_c.endswith('()'):
-                    peak_c = "FALSE"
-                hole_c = f"id IN ({','.join([str(p) for p in pline['holes']])})"
-                if hole_c.endswith('()'):
-                    hole_c = "FALSE"
                 diam = 0
-                if (peak_c == "FALSE") and (hole_c == "FALSE"):
+                if len(pline['peaks']) == 0 and len(pline['holes']) == 0:
                     cursor.execute(f"""
                       SELECT ST_MaxDistance(wkb_geometry, wkb_geometry)
                       FROM {args.table}_polys
-                      WHERE id = {pline['base']}
-                    """)
+                      WHERE id = %(base)s
+                    """, params, prepare=True)
                     diam = float(cursor.fetchall()[0][0])
                 cursor.execute(f"""
                   SELECT peak.svgid,
-                    ST_Distance(ST_GeomFromText('POINT({pts[0]} {pts[1]})'), peak.wkb_geometry)
+                    ST_Distance(ST_MakePoint(%(x)s, %(y)s), peak.wkb_geometry)
                   FROM {args.table}_pts AS peak
-                  WHERE {peak_c}
+                  WHERE id = ANY(%(peaks)s::integer[])
                   UNION ALL
                   SELECT line.type,
-                    ST_Distance(ST_GeomFromText('POINT({pts[0]} {pts[1]})'), ST_Boundary(line.wkb_geometry))
+                    ST_Distance(ST_MakePoint(%(x)s, %(y)s), ST_Boundary(line.wkb_geometry))
                   FROM {args.table}_polys AS line
-                  WHERE id = {pline['base']} OR {hole_c}
-                """)
+                  WHERE id = %(base)s OR id = ANY(%(holes)s::integer[])
+                """, params, prepare=True)
                 return calc_bary(cursor.fetchall(), diam) * float(args.hscale)
     return 0
 
@@ -187,13 +183,9 @@ def main():
         help='float scale for db ft to out band value', required=True)
     args = parser.parse_args()
 
-    conn = psycopg2.connect(
-        user=f"{args.db.split('@')[0].split(':')[0]}",
-        password=f"{args.db.split('@')[0].split(':')[1]}",
-        database=f"{args.db.split('@')[1].split(':')[0]}",
-        host=f"{args.db.split('@')[1].split(':')[1]}",
-        port=f"{args.db.split('@')[1].split(':')[2]}")
+    conn = geo_db.connect(args.db, 'height')
     cursor = conn.cursor()
+    geo_db.ensure_indexes(cursor, f"{args.table}_polys", f"{args.table}_pts")
 
     # Initialize
     cursor.execute(f"""
@@ -5,7 +5,9 @@ done.
 """
 import sys
 import argparse
-import psycopg2
+import geo_db
+# svg2geo puts LAKES lines filled #d4effc in this category
+from geo_categories import LAKE
 
 def main():
     """Main method."""
@@ -23,17 +25,15 @@ def main():
         help='verbose', required=False)
     args = parser.parse_args()
 
-    conn = psycopg2.connect(
-        user=f"{args.db.split('@')[0].split(':')[0]}",
-        password=f"{args.db.split('@')[0].split(':')[1]}",
-        database=f"{args.db.split('@')[1].split(':')[0]}",
-        host=f"{args.db.split('@')[1].split(':')[1]}",
-        port=f"{args.db.split('@')[1].split(':')[2]}")
+    conn = geo_db.connect(args.db, 'lakes')
     cursor = conn.cursor()
+    geo_db.ensure_indexes(cursor, f"{args.table}_lines")
 
     # Initialize
     cursor.execute(f"""
-      ALTER TABLE {args.table}_lines ALTER id SET NOT NULL;
+      ALTER TABLE {args.table}_lines ALTER id SET NOT NULL
+    """)
+    cursor.execute(f"""
       SELECT id, wkb_geometry FROM {args.table}_lines WHERE type LIKE '%LAKES%'
     """)
     print(f"Identifying lines: {cursor.fetchall()[0][0]}")
@@ -42,7 +42,7 @@ def main():
     print("Elevate all lakes")
     cursor.execute(f"""
       UPDATE {args.table}_lines SET type = 'Lake'
-      WHERE ST_IsClosed(wkb_geometry) AND type LIKE '%LAKES%' AND style LIKE '%fill: #d4effc%'
+      WHERE ST_IsClosed(wkb_geometry) AND category = {LAKE}
     """)
 
     cursor.execute(f"""
@@ -56,7 +56,7 @@ def main():
           )
           ORDER BY ST_Length(geo) DESC LIMIT 1
         )
-      WHERE type LIKE '%LAKES%' AND style LIKE '%fill: #d4effc%'
+      WHERE category = {LAKE} AND type LIKE '%LAKES%'
     """)
     conn.commit()
 
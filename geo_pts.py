@@ -4,15 +4,25 @@ Create peak names and height.
 """
 import argparse
 import sys
-import psycopg2
+import geo_db
 
 # Distance of name from (intended) POI
 EPS = 0.04
 # Distance for duplicates
 EPSD = 0.001
 
+def write_names(cursor, table, rows):
+    """Set name and svgid by id; the last row of an id wins."""
+    rows = list({row[0]: row for row in rows}.values())
+    geo_db.write_back(cursor, ['id integer', 'name varchar', 'svgid varchar'], rows, f"""
+      UPDATE {table} AS t0 SET name = t1.name, svgid = t1.svgid
+      FROM write_back AS t1
+      WHERE t0.id = t1.id
+    """)
+
 def obtain_names(args, cursor):
     """Associate names to peaks"""
+    nearest = geo_db.by_distance("t1.wkb_geometry", "t3.wkb_geometry")
     cursor.execute(f"""
       SELECT count(*) FROM {args.table}_pts WHERE name = '-'
     """)
@@ -51,20 +61,14 @@ def obtain_names(args, cursor):
           FROM {args.table}_pts AS t3
           WHERE regexp_like(t3.name, 'PeakName/') AND
             NOT (t3.name LIKE '%000' OR t3.name LIKE '%500')
-          ORDER BY ST_Distance(t1.wkb_geometry, t3.wkb_geometry)
+          ORDER BY {nearest}
           LIMIT 1
         )
         AS t2
         WHERE t1.type = 'PEAK' AND dist < {EPS} ORDER BY dist DESC
       )
     """)
-    for row in cursor.fetchall():
-        row1 = row[1].replace("'", "''")
-        cursor.execute(f"""
-          UPDATE {args.table}_pts
-          SET name = '{row1}', svgid = {row[2]}
-          WHERE id = {row[0]}
-        """)
+    write_names(cursor, f"{args.table}_pts", cursor.fetchall())
 
     print("Label lakes")
     cursor.execute(f"""
@@ -76,20 +80,14 @@ def obtain_names(args, cursor):
           SELECT t3.name AS name, ST_Distance(t1.wkb_geometry, t3.wkb_geometry) AS dist
           FROM {args.table}_pts AS t3
           WHERE regexp_like(t3.name, 'AnyName/Lake')
-          ORDER BY ST_Distance(t1.wkb_geometry, t3.wkb_geometry)
+          ORDER BY {nearest}
           LIMIT 1
         )
         AS t2
-        WHERE t1.style LIKE '%fill: #d4effc%' AND dist < {EPS} ORDER BY dist DESC
+        WHERE t1.fill = '#d4effc' AND dist < {EPS} ORDER BY dist DESC
       )
     """)
-    for row in cursor.fetchall():
-        row1 = row[1].replace("'", "''")
-        cursor.execute(f"""
-          UPDATE {args.table}_lines
-          SET name = '{row1}', svgid = {row[2]}
-          WHERE id = {row[0]}
-        """)
+    write_names(cursor, f"{args.table}_lines", cursor.fetchall())
 
     print("Label any")
     cursor.execute(f"""
@@ -102,7 +100,7 @@ def obtain_names(args, cursor):
           FROM {args.table}_pts AS t3
           WHERE regexp_like(t3.name, 'AnyName/') AND
             NOT (t3.name LIKE '%000' OR t3.name LIKE '%500')
-          ORDER BY ST_Distance(t1.wkb_geometry, t3.wkb_geometry) LIMIT 1
+          ORDER BY {nearest} LIMIT 1
         )
         AS t2
         WHERE (
@@ -134,13 +132,7 @@ def obtain_names(args, cursor):
         ORDER BY dist DESC
       )
     """)
-    for row in cursor.fetchall():
-        row1 = row[1].replace("'", "''")
-        cursor.execute(f"""
-          UPDATE {args.table}_pts
-          SET name = '{row1}', svgid = '{row[2]}'
-          WHERE id = {row[0]}
-        """)
+    write_names(cursor, f"{args.table}_pts", cursor.fetchall())
 
 def duplicate_nonames(args, cursor):
     """Delete clear, but unnamed duplicates."""
@@ -148,7 +140,7 @@ def duplicate_nonames(args, cursor):
     cursor.execute(f"""
       DELETE FROM {args.table}_pts AS t0 USING (
         SELECT t1.id FROM {args.table}_pts AS t1, {args.table}_pts AS t2
-        WHERE t1.id <> t2.id AND ST_Distance(t1.wkb_geometry, t2.wkb_geometry) < {EPSD}
+        WHERE t1.id <> t2.id AND {geo_db.within("t1.wkb_geometry", "t2.wkb_geometry", EPSD)}
           AND t1.name = '-' AND t2.name <> '-'
       ) AS t1 (id)
       WHERE t0.id = t1.id
@@ -193,13 +185,9 @@ def main():
         help='verbose', required=False)
     args = parser.parse_args()
 
-    conn = psycopg2.connect(
-        user=f"{args.db.split('@')[0].split(':')[0]}",
-        password=f"{args.db.split('@')[0].split(':')[1]}",
-        database=f"{args.db.split('@')[1].split(':')[0]}",
-        host=f"{args.db.split('@')[1].split(':')[1]}",
-        port=f"{args.db.split('@')[1].split(':')[2]}")
+    conn = geo_db.connect(args.db, 'pts')
     cursor = conn.cursor()
+    geo_db.ensure_indexes(cursor, f"{args.table}_pts", f"{args.table}_lines")
 
     obtain_names(args, cursor)
     duplicate_nonames(args, cursor)
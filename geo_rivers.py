@@ -4,7 +4,7 @@ Detect all rivers.
 """
 import sys
 import argparse
-import psycopg2
+import geo_db
 
 # This is used as a gap measure to connect river endpoints or lakes;
 # if the distance is smaller than twice this, we assume rivers and
@@ -22,51 +22,51 @@ def make_axis(verbose, table, cursor, bound):
 
     # This removes the "stingers", unfortunately a few connectors as well
     cursor.execute(f"""
-      SELECT ST_AsText(geo) FROM (
+      SELECT geo FROM (
         SELECT (
-          ST_Dump(ST_LineMerge(CG_ApproximateMedialAxis(ST_MakePolygon('{bound[1]}'::geometry))))
+          ST_Dump(ST_LineMerge(CG_ApproximateMedialAxis(ST_MakePolygon(%s))))
         ).geom
         AS geo
       )
       WHERE ST_Length(geo) > {EPS}
-    """)
+    """, [bound[1]])
     merge = list(cursor.fetchall())
 
     # Bring the connectors back in
     while len(merge) > 1:
         dist = [1 + 2*EPS, 0]
         for idx in range(1, len(merge)):
-            cursor.execute(f"""
-              SELECT ST_Distance('{merge[0][0]}'::geometry, '{merge[idx][0]}'::geometry)
-            """)
+            cursor.execute("""
+              SELECT ST_Distance(%s, %s)
+            """, [merge[0][0], merge[idx][0]])
             test = cursor.fetchall()[0][0]
             if test < dist[0]:
                 dist = [test, idx]
         if len(merge) % 100 == 99:
             print(f"- - Long loop: {len(merge) + 1}")
-        cursor.execute(f"""
-          SELECT ST_AsText(ST_LineMerge(ST_Union(
+        cursor.execute("""
+          SELECT ST_LineMerge(ST_Union(
             ARRAY[
-              '{merge[0][0]}'::geometry, '{merge[dist[1]][0]}'::geometry,
-              ST_ShortestLine('{merge[0][0]}'::geometry, '{merge[dist[1]][0]}'::geometry)
+              %(first)s, %(closest)s,
+              ST_ShortestLine(%(first)s, %(closest)s)
             ]
-          )))
-        """)
+          ))
+        """, {'first': merge[0][0], 'closest': merge[dist[1]][0]})
         merge[dist[1]] = cursor.fetchall()[0]
         merge.pop(0)
 
     # Some of the "basin" river trees are from a single polygon.
     if len(merge) > 0: # = 1
-        if "MULTILINESTRING" in merge[0][0]:
-            cursor.execute(f"SELECT ST_AsText((ST_Dump('{merge[0][0]}'::geometry)).geom)")
+        if merge[0][0].geom_type == 'MultiLineString':
+            cursor.execute("SELECT (ST_Dump(%s)).geom", [merge[0][0]])
             merge = cursor.fetchall()
         if len(merge) > 1:
             verbosity(verbose, f"- - {len(merge)} axis'")
     for line in merge:
         cursor.execute(f"""
           INSERT INTO {table} (id, name, type, wkb_geometry)
-          VALUES (nextval('serial'), 'candidate', 'STREAMS', '{line[0]}'::geometry)
-        """)
+          VALUES (nextval('serial'), 'candidate', 'STREAMS', %s)
+        """, [line[0]])
     if len(merge) == 0:
         print(f"- Can't create axis for {bound[0]}")
 
@@ -92,12 +92,12 @@ def split_basin_river(verbose, table, cursor, river):
       )
     """
     cursor.execute(f"""
-      SELECT ST_AsText((
+      SELECT (
         ST_Dump(
-          ST_Split(ST_Difference('{river[1]}'::geometry, ST_Buffer('{river[3]}'::geometry, {EPS})), {blade})
+          ST_Split(ST_Difference(%s, ST_Buffer(%s, {EPS})), {blade})
         )
-      ).geom)
-    """)
+      ).geom
+    """, [river[1], river[3]])
     lines = cursor.fetchall()
     verbosity(verbose, f"- - new rivers: {len(lines)}")
     for line in lines:
@@ -105,10 +105,10 @@ def split_basin_river(verbose, table, cursor, river):
           INSERT INTO {table} (id, name, type, style, wkb_geometry)
           VALUES (
             nextval('serial'), 'temporary area river', '/STREAMS-LAKE/tmp-river',
-            '%fill: #36868d%', ST_Boundary('{line[0]}'::geometry)
+            '%%fill: #36868d%%', ST_Boundary(%s)
           )
           RETURNING id
-        """)
+        """, [line[0]])
         verbosity(verbose, f"- add river {cursor.fetchall()[0][0]}")
 
     cursor.execute(f"""
@@ -120,88 +120,94 @@ def split_river(verbose, table, cursor, river):
     verbosity(verbose, f"- Remove lakes from {river[0]}")
     cursor.execute(f"""
       SELECT (ST_Dump(ST_LineMerge(
-        ST_Difference('{river[1]}'::geometry, ST_MakeValid('{river[3]}'::geometry))
+        ST_Difference(%s, ST_MakeValid(%s))
       ))).geom
-    """)
+    """, [river[1], river[3]])
     lines = cursor.fetchall()
     verbosity(verbose, f"- - new rivers: {len(lines)}")
     for line in lines:
         cursor.execute(f"""
           INSERT INTO {table} (id, name, type, wkb_geometry)
-          VALUES (nextval('serial'), 'candidate', 'STREAMS', '{line[0]}'::geometry)
-        """)
+          VALUES (nextval('serial'), 'candidate', 'STREAMS', %s)
+        """, [line[0]])
     cursor.execute(f"UPDATE {table} SET name = 'split candidate' WHERE id = {river[0]}")
 
 def connect_to_level(args, cursor, connect_to, level):
-    """Find lakes and rivers connected to level lakes and rivers."""
+    """
+    Find lakes and rivers connected to level lakes and rivers.  Runs in
+    pipeline mode: statements are only waited for when fetched.
+    """
     verbosity(args.verbose, f"Handle level {level}")
+    check = cursor.connection.cursor()
 
-    geom = f"'{connect_to[0][0]}'::geometry"
+    geom = "%(level)s"
     # Rivers to level
     cursor.execute(f"""
       SELECT id, ST_Distance({geom}, ST_StartPoint(wkb_geometry)),
         ST_Distance({geom}, ST_EndPoint(wkb_geometry))
       FROM {args.table}_lines
-      WHERE name = 'candidate' AND (type NOT LIKE 'River/%' OR type IS NULL)
+      WHERE name = 'candidate' AND (type NOT LIKE 'River/%%' OR type IS NULL)
+        -- implied by the next test, but can use the index
+        AND ST_DWithin({geom}, wkb_geometry, {2*EPS})
         AND (
-          ST_Distance({geom}, ST_StartPoint(wkb_geometry)) < 2*{EPS} OR
-          ST_Distance({geom}, ST_EndPoint(wkb_geometry)) < 2*{EPS}
+          {geo_db.within(geom, "ST_StartPoint(wkb_geometry)", 2*EPS)} OR
+          {geo_db.within(geom, "ST_EndPoint(wkb_geometry)", 2*EPS)}
         )
-    """)
+    """, {'level': connect_to[0][0]})
     lines = cursor.fetchall()
     verbosity(args.verbose and len(lines) > 0, f"- connect {len(lines)} rivers")
     for line in lines:
         verbosity(args.verbose, f"- - line {line[0]}")
         vertex = 'start' if line[1] < line[2] else 'end'
         idx = 0 if vertex == 'start' else -1
+        params = {'level': connect_to[0][0], 'id': line[0]}
         while True:
             cursor.execute(f"""
-              SELECT ST_NPoints(wkb_geometry) FROM {args.table}_lines WHERE id = {line[0]}
-            """)
-            line_length = cursor.fetchall()
-            cursor.execute(f"""
+              SELECT ST_NPoints(wkb_geometry) FROM {args.table}_lines WHERE id = %(id)s
+            """, params, prepare=True)
+            check.execute(f"""
               SELECT ST_Intersects({geom}, wkb_geometry)
-              FROM {args.table}_lines WHERE id = {line[0]}
-            """)
-            intersects = cursor.fetchall()[0]
+              FROM {args.table}_lines WHERE id = %(id)s
+            """, params, prepare=True)
+            line_length = cursor.fetchall()
+            intersects = check.fetchall()[0]
             if not intersects[0] or line_length[0][0] == 2:
                 break
             verbosity(args.verbose, f"- - - reduce from {line_length[0][0]} points")
             cursor.execute(f"""
               UPDATE {args.table}_lines SET wkb_geometry =
                 ST_RemovePoint(wkb_geometry, {idx} * (1 - ST_NPoints(wkb_geometry)))
-              WHERE id = {line[0]}
-            """)
+              WHERE id = %(id)s
+            """, params, prepare=True)
         cursor.execute(f"""
           SELECT wkb_geometry,
             ST_ClosestPoint({geom}, ST_{vertex.capitalize()}Point(wkb_geometry))
           FROM {args.table}_lines
-          WHERE id = {line[0]}
-        """)
+          WHERE id = %(id)s
+        """, params, prepare=True)
         new_line = cursor.fetchall()
         cursor.execute(f"""
           INSERT INTO {args.table}_lines (id, name, type, wkb_geometry)
           VALUES (
             nextval('serial'), '-', 'River/{level}/Mouth:{vertex}',
-            ST_SetPoint(
-              ST_RemoveRepeatedPoints('{new_line[0][0]}'::geometry), {idx},
-              '{new_line[0][1]}'::geometry
-            )
-          );
-          DELETE FROM {args.table}_lines WHERE id = {line[0]}
-        """)
+            ST_SetPoint(ST_RemoveRepeatedPoints(%s), {idx}, %s)
+          )
+        """, [new_line[0][0], new_line[0][1]], prepare=True)
+        cursor.execute(f"""
+          DELETE FROM {args.table}_lines WHERE id = %s
+        """, [line[0]], prepare=True)
 
     # Lakes to level (we assume no intersection of lakes)
     cursor.execute(f"""
       SELECT id, ST_Distance(wkb_geometry, {geom})
       FROM {args.table}_lines
-      WHERE (style NOT LIKE 'Connected/%' OR style IS NULL)
+      WHERE (style NOT LIKE 'Connected/%%' OR style IS NULL)
         AND (
-          type LIKE 'COASTLINE/tmp-lake%' OR type LIKE 'Lake%'
+          type LIKE 'COASTLINE/tmp-lake%%' OR type LIKE 'Lake%%'
         )
         AND
-          ST_Distance(wkb_geometry, {geom}) < {EPS}
-    """)
+          {geo_db.within("wkb_geometry", geom, EPS)}
+    """, {'level': connect_to[0][0]})
     lakes = cursor.fetchall()
     verbosity(args.verbose and len(lakes) > 0, f"- connect {len(lakes)} lakes")
     for lake in lakes:
@@ -213,30 +219,32 @@ def connect_to_level(args, cursor, connect_to, level):
             FROM (
               SELECT (ST_DumpPoints(wkb_geometry)).geom AS geo
               FROM {args.table}_lines
-              WHERE id = {lake[0]}
+              WHERE id = %(id)s
             )
           )
-        """)
+        """, {'level': connect_to[0][0], 'id': lake[0]}, prepare=True)
         pts = cursor.fetchall()[0]
         cursor.execute(f"""
           UPDATE {args.table}_lines
           SET style = 'Connected/{level}',
-            wkb_geometry = ST_SetPoint(wkb_geometry, path - 1, '{pts[1]}'::geometry)
+            wkb_geometry = ST_SetPoint(wkb_geometry, path - 1, %(end)s)
           FROM (
             SELECT (geo).path[1] AS path, (geo).geom AS geo FROM (
               SELECT ST_DumpPoints(ST_RemoveRepeatedPoints(wkb_geometry))
               AS geo
               FROM {args.table}_lines
-              WHERE id = {lake[0]}
+              WHERE id = %(id)s
             )
-            WHERE (geo).geom = '{pts[0]}'::geometry
+            WHERE (geo).geom = %(start)s
           )
-          WHERE id = {lake[0]};
-          -- Close potentially opened lake --
+          WHERE id = %(id)s
+        """, {'end': pts[1], 'start': pts[0], 'id': lake[0]}, prepare=True)
+        # Close potentially opened lake
+        cursor.execute(f"""
           UPDATE {args.table}_lines
           SET wkb_geometry = ST_AddPoint(wkb_geometry, ST_StartPoint(wkb_geometry))
-          WHERE id = {lake[0]} AND ST_IsClosed(wkb_geometry) = FALSE
-        """)
+          WHERE id = %s AND ST_IsClosed(wkb_geometry) = FALSE
+        """, [lake[0]], prepare=True)
 
 def execute(args, cursor):
     """Actual main method. Iterates through levels."""
@@ -315,7 +323,8 @@ def execute(args, cursor):
 
     # Recurse rivers into rivers
     while len(connect_to) > 0 and connect_to[0][0] is not None:
-        connect_to_level(args, cursor, connect_to, level)
+        with cursor.connection.pipeline():
+            connect_to_level(args, cursor, connect_to, level)
         level = level + 1
         cursor.execute(f"""
           SELECT ST_Collect(wkb_geometry) FROM (
@@ -354,13 +363,9 @@ def main():
         required=False)
     args = parser.parse_args()
 
-    conn = psycopg2.connect(
-        user=f"{args.db.split('@')[0].split(':')[0]}",
-        password=f"{args.db.split('@')[0].split(':')[1]}",
-        database=f"{args.db.split('@')[1].split(':')[0]}",
-        host=f"{args.db.split('@')[1].split(':')[1]}",
-        port=f"{args.db.split('@')[1].split(':')[2]}")
+    conn = geo_db.connect(args.db, 'rivers')
     cursor = conn.cursor()
+    geo_db.ensure_indexes(cursor, f"{args.table}_lines")
 
     # Initialize
     cursor.execute(f"""
@@ -5,25 +5,33 @@ if within reasonable distance.
 """
 import sys
 import argparse
-import psycopg2
+import geo_db
+from geo_categories import LOCATION, ROADS, TRAIL, UNPAVED, PAVED
 
 EPSG = 0.005 # gap to bridge
 
+def roads(alias=None):
+    """SQL testing that the category of the line, in table alias if given, is a road."""
+    column = 'category' if alias is None else f"{alias}.category"
+    return f"{column} IN ({', '.join(str(code) for code in ROADS)})"
+
 def make_adj_lines(args, cursor, pt_lines, index):
     """Make adjacent line and connect."""
-    for pt_line in pt_lines:
-        if args.verbose:
-            print(f"- start/end {pt_line[1]} on {pt_line[0]}")
-        cursor.execute(f"""
-          UPDATE {args.table}_lines
-          SET wkb_geometry = ST_Snap(wkb_geometry, '{pt_line[2]}'::geometry, {EPSG*1.01})
-          WHERE id = {pt_line[0]}
-        """)
-        cursor.execute(f"""
-          UPDATE {args.table}_lines
-          SET wkb_geometry = ST_SetPoint(wkb_geometry, {index}, '{pt_line[2]}'::geometry)
-          WHERE id = {pt_line[1]}
-        """)
+    # Nothing is read back, the updates are sent without waiting
+    with cursor.connection.pipeline():
+        for pt_line in pt_lines:
+            if args.verbose:
+                print(f"- start/end {pt_line[1]} on {pt_line[0]}")
+            cursor.execute(f"""
+              UPDATE {args.table}_lines
+              SET wkb_geometry = ST_Snap(wkb_geometry, %s, {EPSG*1.01})
+              WHERE id = %s
+            """, [pt_line[2], pt_line[0]], prepare=True)
+            cursor.execute(f"""
+              UPDATE {args.table}_lines
+              SET wkb_geometry = ST_SetPoint(wkb_geometry, {index}, %s)
+              WHERE id = %s
+            """, [pt_line[2], pt_line[1]], prepare=True)
 
 def main():
     """Main method."""
@@ -41,20 +49,18 @@ def main():
         help='verbose', required=False)
     args = parser.parse_args()
 
-    conn = psycopg2.connect(
-        user=f"{args.db.split('@')[0].split(':')[0]}",
-        password=f"{args.db.split('@')[0].split(':')[1]}",
-        database=f"{args.db.split('@')[1].split(':')[0]}",
-        host=f"{args.db.split('@')[1].split(':')[1]}",
-        port=f"{args.db.split('@')[1].split(':')[2]}")
+    conn = geo_db.connect(args.db, 'roads')
     cursor = conn.cursor()
+    geo_db.ensure_indexes(cursor, f"{args.table}_lines", f"{args.table}_pts")
 
     # Initialize
     cursor.execute(f"""
       CREATE TEMP SEQUENCE IF NOT EXISTS serial START 200000;
       ALTER TABLE {args.table}_lines ALTER id SET NOT NULL;
-      DELETE FROM {args.table}_lines WHERE type = 'ROUTE';
-      SELECT count(*) FROM {args.table}_lines WHERE type LIKE '%ROADS%'
+      DELETE FROM {args.table}_lines WHERE type = 'ROUTE'
+    """)
+    cursor.execute(f"""
+      SELECT count(*) FROM {args.table}_lines WHERE {roads()}
     """)
     print(f"Identifying lines: {cursor.fetchall()[0][0]}")
 
@@ -63,25 +69,8 @@ def main():
     # '%Keep%','%Manor%','%Mine%','%PEAK%','%Quarry%','%ROAD%' <- Tollhouse
     # '%Rapids%','%Ruin%','%SEA%','%SWAMP%','%Salt%','%Special %',
     # '%special %','%Swamp%','%TOWNS%','%Tribal%','%Waterfall%'
-    sql_locs = "type LIKE '%Abbey%' OR \
-          type LIKE '%BRIDGE%' OR \
-          type LIKE '%Chapter House%' OR \
-          type LIKE '%City' OR \
-          type LIKE '%Ferry%' OR \
-          type LIKE '%Ford%' OR \
-          type LIKE '%Fort%' OR \
-          type LIKE '%Gargun%' OR \
-          type LIKE '%Keep%' OR \
-          type LIKE '%Manor%' OR \
-          type LIKE '%Mine%' OR \
-          type LIKE '%Quarry%' OR \
-          type LIKE '%ROAD%' OR \
-          type LIKE '%Salt%' OR \
-          type LIKE '%Special%' OR \
-          type LIKE '%special%' OR \
-          type LIKE '%TOWNS%' OR \
-          type LIKE '%Tribal%' OR \
-          type LIKE '%Castle%'"
+    # Of these, svg2geo puts those in LOCATIONS in the location category
+    sql_locs = f"category = {LOCATION}"
 
     # Get all locations
     cursor.execute(f"""
@@ -95,8 +84,8 @@ def main():
       SELECT t1.id, array_agg(t2.id), t1.wkb_geometry
       FROM {args.table}_pts AS t1 INNER JOIN LATERAL (
         SELECT id, wkb_geometry FROM {args.table}_lines
-        WHERE type LIKE '%ROADS%' AND
-          ST_Distance(wkb_geometry, t1.wkb_geometry) < {EPSG} AND
+        WHERE {roads()} AND
+          {geo_db.within("wkb_geometry", "t1.wkb_geometry", EPSG)} AND
           ST_Distance(wkb_geometry, t1.wkb_geometry) <> 0
       )
       AS t2 (id, geo) ON TRUE
@@ -111,21 +100,23 @@ def main():
         for pt_i in pt_line[1]:
             cursor.execute(f"""
               UPDATE {args.table}_lines
-              SET wkb_geometry = ST_Snap(wkb_geometry, '{pt_line[2]}'::geometry, {EPSG*1.01})
-              WHERE id = {pt_i}""")
+              SET wkb_geometry = ST_Snap(wkb_geometry, %s, {EPSG*1.01})
+              WHERE id = %s""", [pt_line[2], pt_i], prepare=True)
 
     # Shift all road starts/ends
     cursor.execute(f"""
       SELECT t1.id, t2.id, ST_ClosestPoint(t1.wkb_geometry, ST_StartPoint(t2.geo))
       FROM {args.table}_lines AS t1 INNER JOIN LATERAL (
         SELECT t3.id, t3.wkb_geometry FROM {args.table}_lines AS t3
-        WHERE t3.id <> t1.id AND t3.type LIKE '%ROADS%' AND
-          ST_Distance(ST_StartPoint(t3.wkb_geometry), t1.wkb_geometry) < {EPSG} AND
-          ST_Distance(ST_StartPoint(t3.wkb_geometry), '{pts}'::geometry) > {EPSG/2}
+        WHERE t3.id <> t1.id AND {roads('t3')} AND
+          -- implied by the next test, but can use the index
+          ST_DWithin(t3.wkb_geometry, t1.wkb_geometry, {EPSG}) AND
+          {geo_db.within("ST_StartPoint(t3.wkb_geometry)", "t1.wkb_geometry", EPSG)} AND
+          ST_Distance(ST_StartPoint(t3.wkb_geometry), %s) > {EPSG/2}
       )
       AS t2 (id, geo) ON TRUE
-      WHERE t1.type LIKE '%ROADS%'
-    """)
+      WHERE {roads('t1')}
+    """, [pts])
     pt_lines = cursor.fetchall()
     print(f"Shift {len(pt_lines)} road-starts onto roads")
     # Make adjacent lines include new start points and ending lines end in new start points
@@ -135,12 +126,14 @@ def main():
       SELECT t1.id, t2.id, ST_ClosestPoint(t1.wkb_geometry, ST_EndPoint(t2.geo))
       FROM {args.table}_lines AS t1 INNER JOIN LATERAL (
         SELECT t3.id, t3.wkb_geometry FROM {args.table}_lines AS t3
-        WHERE t3.id <> t1.id AND t3.type LIKE '%ROADS%' AND
-          ST_Distance(ST_EndPoint(t3.wkb_geometry), t1.wkb_geometry) < {EPSG} AND
-          ST_Distance(ST_EndPoint(t3.wkb_geometry), '{pts}'::geometry) > {EPSG/2}
+        WHERE t3.id <> t1.id AND {roads('t3')} AND
+          -- implied by the next test, but can use the index
+          ST_DWithin(t3.wkb_geometry, t1.wkb_geometry, {EPSG}) AND
+          {geo_db.within("ST_EndPoint(t3.wkb_geometry)", "t1.wkb_geometry", EPSG)} AND
+          ST_Distance(ST_EndPoint(t3.wkb_geometry), %s) > {EPSG/2}
       )
       AS t2 (id, geo) ON TRUE
-      WHERE t1.type LIKE '%ROADS%'""")
+      WHERE {roads('t1')}""", [pts])
     pt_lines = cursor.fetchall()
     print(f"Shift {len(pt_lines)} road-end onto roads")
     # Make adjacent line include new end point and ending line end in new end point
@@ -149,49 +142,43 @@ def main():
     print(f"Remove some artifacts")
     cursor.execute(f"""
       SELECT id, ST_NPoints(wkb_geometry) FROM {args.table}_lines
-      WHERE type LIKE '%ROADS%' AND
-        ST_Distance(ST_StartPoint(wkb_geometry), '{pts}'::geometry) < {EPSG} AND
-        ST_Distance(ST_StartPoint(wkb_geometry), '{pts}'::geometry) <> 0
+      WHERE {roads()} AND
+        {geo_db.within("ST_StartPoint(wkb_geometry)", "%(pts)s", EPSG)} AND
+        ST_Distance(ST_StartPoint(wkb_geometry), %(pts)s) <> 0
+    """, {'pts': pts})
+    geo_db.write_back(cursor, ['id integer', 'npoints integer'], cursor.fetchall(), f"""
+      UPDATE {args.table}_lines AS t0
+      SET wkb_geometry = ST_RemovePoint(t0.wkb_geometry, 0)
+      FROM write_back AS t1
+      WHERE t0.id = t1.id AND t1.npoints > 2
+    """, f"""
+      DELETE FROM {args.table}_lines AS t0
+      USING write_back AS t1
+      WHERE t0.id = t1.id AND t1.npoints <= 2
     """)
-    pt_lines = cursor.fetchall()
-    for pt_line in pt_lines:
-        if pt_line[1] > 2:
-            cursor.execute(f"""
-              UPDATE {args.table}_lines
-              SET wkb_geometry = ST_RemovePoint(wkb_geometry, 0)
-              WHERE id = {pt_line[0]}
-            """)
-        else:
-            cursor.execute(f"""
-              DELETE FROM {args.table}_lines
-              WHERE id = {pt_line[0]}
-            """)
     cursor.execute(f"""
       SELECT id, ST_NPoints(wkb_geometry) FROM {args.table}_lines
-      WHERE type LIKE '%ROADS%' AND
-        ST_Distance(ST_EndPoint(wkb_geometry), '{pts}'::geometry) < {EPSG} AND
-        ST_Distance(ST_EndPoint(wkb_geometry), '{pts}'::geometry) <> 0
+      WHERE {roads()} AND
+        {geo_db.within("ST_EndPoint(wkb_geometry)", "%(pts)s", EPSG)} AND
+        ST_Distance(ST_EndPoint(wkb_geometry), %(pts)s) <> 0
+    """, {'pts': pts})
+    geo_db.write_back(cursor, ['id integer', 'npoints integer'], cursor.fetchall(), f"""
+      UPDATE {args.table}_lines AS t0
+      SET wkb_geometry = ST_RemovePoint(t0.wkb_geometry, t1.npoints - 1)
+      FROM write_back AS t1
+      WHERE t0.id = t1.id AND t1.npoints > 2
+    """, f"""
+      DELETE FROM {args.table}_lines AS t0
+      USING write_back AS t1
+      WHERE t0.id = t1.id AND t1.npoints <= 2
     """)
-    pt_lines = cursor.fetchall()
-    for pt_line in pt_lines:
-        if pt_line[1] > 2:
-            cursor.execute(f"""
-              UPDATE {args.table}_lines
-              SET wkb_geometry = ST_RemovePoint(wkb_geometry, {pt_line[1] - 1})
-              WHERE id = {pt_line[0]}
-            """)
-        else:
-            cursor.execute(f"""
-              DELETE FROM {args.table}_lines
-              WHERE id = {pt_line[0]}
-            """)
 
     print(f"Make all trails")
     cursor.execute(f"""
       INSERT INTO {args.table}_lines (id, name, type, wkb_geometry)
       SELECT nextval('serial'), '-', 'Trail', t1.geo FROM (
         SELECT (ST_Dump(ST_LineMerge(ST_Union(wkb_geometry)))).geom FROM {args.table}_lines
-        WHERE type LIKE '%ROADS%' AND style LIKE '%dasharray: 1 1%'
+        WHERE category = {TRAIL}
       )
       AS t1 (geo)
     """)
@@ -200,7 +187,7 @@ def main():
       INSERT INTO {args.table}_lines (id, name, type, wkb_geometry)
       SELECT nextval('serial'), '-', 'Unpaved', t1.geo FROM (
         SELECT (ST_Dump(ST_LineMerge(ST_Union(wkb_geometry)))).geom FROM {args.table}_lines
-        WHERE type LIKE '%ROADS%' AND style LIKE '%dasharray: 2 1%'
+        WHERE category = {UNPAVED}
       )
       AS t1 (geo)""")
     print(f"Make all paved roads")
@@ -208,7 +195,7 @@ def main():
       INSERT INTO {args.table}_lines (id, name, type, wkb_geometry)
       SELECT nextval('serial'), '-', 'Paved', t1.geo FROM (
         SELECT (ST_Dump(ST_LineMerge(ST_Union(wkb_geometry)))).geom FROM {args.table}_lines
-        WHERE type LIKE '%ROADS%' AND style NOT LIKE '%dasharray:%'
+        WHERE category = {PAVED}
       )
       AS t1 (geo)
     """)
@@ -4,15 +4,15 @@ Creates all vegetation (including shoal/reef).
 """
 import sys
 import argparse
-import psycopg2
+import geo_db
 
 EPSG = 0.00025 # grow to cover draw glitches
 EPSI = 0.01 # grow swamp
 EPSD = 0.0125 # shrink swamp
 
 def geo_array(rows):
-    """Create a postgis geometry array."""
-    return "'" + "'::geometry, '".join([row[0] for row in rows]) + "'::geometry"
+    """Collect the geometries of rows, bound as %s::geometry[]."""
+    return [row[0] for row in rows]
 
 def make_swamp(args, cursor):
     """Make Swamp out of various pieces."""
@@ -37,12 +37,12 @@ def make_swamp(args, cursor):
         cursor.execute(f"""
           SELECT ST_Union(ST_MakeValid(ST_MakePolygon(wkb_geometry)))
           FROM {args.table}_lines
-          WHERE type LIKE '%SWAMP%' AND ST_NPoints(wkb_geometry) > 3 AND
+          WHERE type LIKE '%%SWAMP%%' AND ST_NPoints(wkb_geometry) > 3 AND
             {poly[0]} <> id AND
             CASE WHEN ST_IsClosed(wkb_geometry) THEN
-              ST_Covers('{poly[1]}'::geometry, ST_MakePolygon(wkb_geometry))
+              ST_Covers(%s, ST_MakePolygon(wkb_geometry))
             END
-        """)
+        """, [poly[1]])
         holes = cursor.fetchall()[0]
         if args.verbose:
             print(f"- swamp poly {poly[0]}")
@@ -50,8 +50,8 @@ def make_swamp(args, cursor):
             if args.verbose:
                 print(f"- - with holes")
             cursor.execute(f"""
-              SELECT ST_Difference('{poly[1]}'::geometry, '{holes[0]}'::geometry)
-            """)
+              SELECT ST_Difference(%s, %s)
+            """, [poly[1], holes[0]])
             ret.append([cursor.fetchall()[0][0]])
         else:
             ret.append([poly[1]])
@@ -101,13 +101,9 @@ def main():
         help='verbose', required=False)
     args = parser.parse_args()
 
-    conn = psycopg2.connect(
-        user=f"{args.db.split('@')[0].split(':')[0]}",
-        password=f"{args.db.split('@')[0].split(':')[1]}",
-        database=f"{args.db.split('@')[1].split(':')[0]}",
-        host=f"{args.db.split('@')[1].split(':')[1]}",
-        port=f"{args.db.split('@')[1].split(':')[2]}")
+    conn = geo_db.connect(args.db, 'vegetation')
     cursor = conn.cursor()
+    geo_db.ensure_indexes(cursor, f"{args.table}_lines", f"{args.table}_polys")
 
     # Initialize
     types = ["WOODLAND", # default
@@ -124,7 +120,9 @@ def main():
     # Initialize
     cursor.execute(f"""
       CREATE TEMP SEQUENCE IF NOT EXISTS serial START 300000;
-      ALTER TABLE {args.table}_polys ALTER id SET NOT NULL;
+      ALTER TABLE {args.table}_polys ALTER id SET NOT NULL
+    """)
+    cursor.execute(f"""
       SELECT count(*) FROM {args.table}_lines WHERE {sql_area}
     """)
     print(f"Identifying areas: {cursor.fetchall()[0][0]}")
@@ -140,7 +138,7 @@ def main():
             """)
             rows = list(cursor.fetchall())
             land = geo_array(rows)
-            cursor.execute(f"""SELECT ST_Union(ARRAY[{land}])""")
+            cursor.execute("SELECT ST_Union(%s::geometry[])", [land])
             land_sql = cursor.fetchall()[0][0]
         elif typ == "SWAMP":
             rows = make_swamp(args, cursor)
@@ -163,27 +161,22 @@ def main():
         for j in range(i + 1, len(types) - 1):
             if args.verbose:
                 print(f"- reduce {ty_i} by {types[j]}")
-            cursor.execute(f"""
-              SELECT ST_Union(ARRAY[{raw[types[j]]}])
-            """)
-            cursor.execute(f"""
-              SELECT ST_Difference(
-                ST_Union(ARRAY[{redux[ty_i]}]), ST_Union(ARRAY[{raw[types[j]]}])
-              )
-            """)
+            cursor.execute("""
+              SELECT ST_Difference(ST_Union(%s::geometry[]), ST_Union(%s::geometry[]))
+            """, [redux[ty_i], raw[types[j]]])
             redux[ty_i] = geo_array(list(cursor.fetchall()))
 
         cursor.execute(f"""
           WITH ret AS (
             INSERT INTO {args.table}_polys (id, name, type, wkb_geometry)
             SELECT nextval('serial'), '-', 'VEGTMP/{ty_i}', t1.geo FROM (
-              SELECT (ST_Dump(ST_Union(ARRAY[{redux[ty_i]}]))).geom
+              SELECT (ST_Dump(ST_Union(%s::geometry[]))).geom
             )
             AS t1 (geo)
             WHERE ST_GeometryType(t1.geo) = 'ST_Polygon' RETURNING id
           )
           SELECT * FROM ret
-        """)
+        """, [redux[ty_i]])
         if args.verbose:
             print(f"- normalized {len(cursor.fetchall())}")
 
@@ -191,22 +184,22 @@ def main():
     cursor.execute(f"""
       INSERT INTO {args.table}_polys (id, name, type, wkb_geometry)
       SELECT nextval('serial'), '-', 'VEG/' || t1.typ, t1.geo FROM (
-        SELECT (ST_Dump(ST_Intersection(wkb_geometry, '{land_sql}'::geometry))).geom, substring(type, 8)
+        SELECT (ST_Dump(ST_Intersection(wkb_geometry, %s))).geom, substring(type, 8)
         FROM {args.table}_polys
-        WHERE type LIKE '%VEGTMP/%' AND type NOT LIKE '%SHOAL%'
+        WHERE type LIKE '%%VEGTMP/%%' AND type NOT LIKE '%%SHOAL%%'
       )
       AS t1 (geo, typ)
-    """)
+    """, [land_sql])
     print(f"Restrict shoal/reef to off land")
     cursor.execute(f"""
       INSERT INTO {args.table}_polys (id, name, type, wkb_geometry)
       SELECT nextval('serial'), '-', 'VEG/' || t1.typ, t1.geo FROM (
-        SELECT (ST_Dump(ST_Difference(wkb_geometry, '{land_sql}'::geometry))).geom, substring(type, 8)
+        SELECT (ST_Dump(ST_Difference(wkb_geometry, %s))).geom, substring(type, 8)
         FROM {args.table}_polys
-        WHERE type LIKE '%VEGTMP/%' AND type LIKE '%SHOAL%'
+        WHERE type LIKE '%%VEGTMP/%%' AND type LIKE '%%SHOAL%%'
       )
       AS t1 (geo, typ)
-    """)
+    """, [land_sql])
     cursor.execute(f"""
       DELETE FROM {args.table}_polys
       WHERE type LIKE '%VEGTMP/%'
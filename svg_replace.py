@@ -3,11 +3,16 @@
 """
 Extract additional information
 """
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 from dataclasses import dataclass
 import argparse
 import sys
 import re
 
+# Minimum number of characters handed to a worker in --jobs mode
+CHUNK_SIZE = 1 << 20
+
 @dataclass
 class Buffer:
     """Encapsulate buffer."""
@@ -57,37 +62,49 @@ LETTERS = {
     "v-.44s1":                         "Z"
 }
 
-def graph2char(line, repl, strg, location):
+# All glyphs in one alternation; group i + 1 belongs to the i-th LETTERS key.
+GLYPH = re.compile(r' *<path class="cls-1201" d="M.{3,8},.{3,8}(?:' +
+                   '|'.join(f'({key})' for key in LETTERS) + ').*"/>')
+GLYPH_CHARS = list(LETTERS.values())
+
+def graph2char(line, location):
     """Replace graphics with correct character."""
-    ret = re.sub(r' *<path class="cls-1201" d="M.{3,8},.{3,8}' + strg + '.*"/>', repl, line)
-    if ret != line:
+    if 'cls-1201' not in line:
+        return line, location
+    match = GLYPH.search(line)
+    if match is None:
+        return line, location
+    if location[0] == 0:
         mat = re.match(r'.*d="M([0-9.]{3,8}),([0-9.]{3,8}).*"', line)
-        if location[0] == 0:
-            location = [mat.group(1), mat.group(2)]
-    return ret, location
+        location = [mat.group(1), mat.group(2)]
+    return line[:match.start()] + GLYPH_CHARS[match.lastindex - 1] + line[match.end():], location
 
-def print_continue(text, out_file):
-    """Print and reset."""
-    print(text, end='', file=out_file)
+def split_lines(chunks):
+    """Re-split emitted text chunks into lines, like reading them from a file."""
+    rest = ''
+    for chunk in chunks:
+        rest += chunk
+        *lines, rest = rest.split('\n')
+        for line in lines:
+            yield line + '\n'
+    if rest:
+        yield rest
 
-def substitute_spans(args):
+def substitute_spans(lines):
     """Replace all <span/> names."""
-    svg_out_file = open(args.midfile, 'w')
     buf = Buffer(loc=[0, 0])
-    for new_line in open(args.infile, 'r'):
+    for new_line in lines:
         new_txt = new_line
         buf.lines += new_line
 
         # Graphical peak text
-        for key in LETTERS:
-            new_txt, buf.loc = graph2char(new_txt, LETTERS[key], key, buf.loc)
+        new_txt, buf.loc = graph2char(new_txt, buf.loc)
         if new_txt != new_line:
             buf.txt += new_txt.rstrip()
             continue
         if len(buf.txt) > 5:
-            new_line = f'<circle class="" cx="{buf.loc[0]}" cy="{buf.loc[1]}" ' + \
+            yield f'<circle class="" cx="{buf.loc[0]}" cy="{buf.loc[1]}" ' + \
                 f'data-name="PeakName/{buf.txt}"/>\n' + new_txt
-            print_continue(new_line, svg_out_file)
             buf = Buffer(loc=[0, 0])
             continue
 
@@ -102,23 +119,21 @@ def substitute_spans(args):
             new_txt
         )
         if new_txt != buf.lines.rstrip():
-            print_continue(new_txt, svg_out_file)
-            print('', file=svg_out_file) # CR
+            yield new_txt + '\n'
             buf = Buffer(loc=[0, 0])
             continue
 
-        print_continue(buf.lines, svg_out_file)
+        yield buf.lines
         buf = Buffer(loc=[0, 0])
 
-def substitute_circles(args):
+def substitute_circles(lines, flush=False):
     """Connect circle Names that have y-distance of 6."""
-    svg_out_file = open(args.outfile, 'w')
     bline = ''
     og_1 = ''
     og_2 = ''
     og_3 = ''
     og_4 = ''
-    for line0 in open(args.midfile, 'r'):
+    for line0 in lines:
         mat = re.match(
             r'<circle class="cls-(.*)" cx="(.*)" cy="(.*)" data-name="AnyName/(.*)"/>', line0
         )
@@ -126,21 +141,63 @@ def substitute_circles(args):
             [g_1, g_2, g_3, g_4] = [mat.group(1), mat.group(2), mat.group(3), mat.group(4)]
             if og_1 == g_1 and int(10*(float(g_3) - float(og_3))) == 60:
                 g_4 = og_4.strip() + g_4.strip()
-                print(
-                    f'<circle class="" cx="{og_2}" cy="{og_3}" data-name="AnyName/{g_4}"/>',
-                    end='\n', file=svg_out_file
-                )
+                yield f'<circle class="" cx="{og_2}" cy="{og_3}" data-name="AnyName/{g_4}"/>\n'
                 bline = ''
                 og_1 = ''
             else:
-                print(bline, end='', file=svg_out_file)
+                yield bline
                 [og_1, og_2, og_3, og_4] = [g_1, g_2, g_3, g_4]
                 bline = line0
         else:
-            print(bline, end='', file=svg_out_file)
-            print(line0, end='', file=svg_out_file)
+            yield bline
+            yield line0
             bline = ''
             og_1 = ''
+    if flush:
+        yield bline
+
+def substitute(lines, flush=False):
+    """Chain all substitutions: spans -> glyph merge -> circle join."""
+    return substitute_circles(split_lines(substitute_spans(lines)), flush)
+
+def substitute_chunk(chunk, last):
+    """Substitute one chunk in a worker. All but the last chunk flush their pending circle."""
+    return ''.join(substitute(split_lines([chunk]), not last))
+
+def split_chunks(lines, size):
+    """
+    Cut the input into chunks of at least size characters.  Cuts are
+    only made in front of a <g> line that does not follow a glyph line;
+    both substitutions start from a clean state there.
+    """
+    chunk = []
+    length = 0
+    prev = ''
+    for line in lines:
+        if length >= size and line.lstrip().startswith('<g') and 'cls-1201' not in prev:
+            yield ''.join(chunk)
+            chunk = []
+            length = 0
+        chunk.append(line)
+        length += len(line)
+        prev = line
+    yield ''.join(chunk)
+
+def substitute_parallel(lines, jobs, out_file):
+    """Substitute chunks in a process pool and write them back in order."""
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        pending = deque()
+        chunks = split_chunks(lines, CHUNK_SIZE)
+        chunk = next(chunks)
+        for next_chunk in chunks:
+            pending.append(pool.submit(substitute_chunk, chunk, False))
+            chunk = next_chunk
+            # Bound the number of chunks in flight
+            if len(pending) > 2 * jobs:
+                out_file.write(pending.popleft().result())
+        pending.append(pool.submit(substitute_chunk, chunk, True))
+        for future in pending:
+            out_file.write(future.result())
 
 def main():
     """Main method."""
@@ -154,10 +211,14 @@ def main():
                         required=False)
     parser.add_argument('-o', '--output', dest='outfile', help='output file name',
                         required=True)
+    parser.add_argument('-j', '--jobs', dest='jobs', type=int, default=1,
+                        help='number of worker processes', required=False)
     args = parser.parse_args()
-    args.midfile = args.outfile + "-0"
-    substitute_spans(args)
-    substitute_circles(args)
+    with open(args.infile, 'r') as svg_in_file, open(args.outfile, 'w') as svg_out_file:
+        if args.jobs > 1:
+            substitute_parallel(svg_in_file, args.jobs, svg_out_file)
+        else:
+            svg_out_file.writelines(substitute(svg_in_file))
 
 if __name__ == '__main__':
     main()